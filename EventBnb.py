@@ -1,8 +1,14 @@
+import hashlib
+import importlib.util
+import os
 import re
+import numpy as np
 import pandas as pd
 import streamlit as st
 import time
 import random
+import threading
+from collections import deque
 
 # ----------------------------
 # Config
@@ -21,12 +27,71 @@ SHOW_COLS = [
     "suggested_price",
 ]
 
+# Columns the app actually reads (lookup key + display + prompt)
+LOAD_COLS = [KEY_COL] + SHOW_COLS + ["description"]
+
+# Part of the Parquet cache filename: bump whenever load_df's columns/dtypes change,
+# so a cache written by older code is never picked up
+PARQUET_SCHEMA_VERSION = 2
+
+# Arrow-backed strings when pyarrow is installed: == on the key col runs in Arrow's compare kernel
+KEY_DTYPE = "string[pyarrow]" if importlib.util.find_spec("pyarrow") else "string"
+
+# Explicit dtypes so read_csv doesn't have to infer (and we skip a cast pass afterwards)
+CSV_DTYPES = {
+    KEY_COL: KEY_DTYPE,
+    "event_name": "string",
+    # Low-cardinality, repeated on many rows -> dictionary-encoded
+    "event_type": "category",
+    "venue_name": "category",
+    "distance_km": "float64",  # float32 would print as 0.30000001192092896 in prompts
+    "days_until_event": "Int32",
+    "current_price": "float64",
+    "suggested_price": "float64",
+}
+
 RENAME_COLS = {
     "days_until_event": "days_until",
     "suggested_price": "suggested_price_for_event",
 }
 
-ID_RE = re.compile(r"^[A-Za-z0-9]+$")
+BATCH_RE = re.compile(r"\[(\d+)\]\s*")
+
+# event_date stays datetime64 in df; this is only applied when showing it
+DATE_FMT = "%Y-%m-%d"
+
+# Prompt fields (row columns) and their fallbacks for missing / NaN values
+PROMPT_FIELDS = ["event_name", "event_type", "event_date", "venue_name", "distance_km", "days_until_event"]
+PROMPT_DEFAULTS = {
+    "event_name": "an upcoming event",
+    "event_type": "event",
+    "event_date": "",
+    "venue_name": "",
+    "distance_km": "",
+    "days_until_event": "",
+}
+
+PROMPT_TEMPLATE = (
+    "Rewrite this Airbnb desc for guests of {event_name} ({event_type}, {event_date}) "
+    "at {venue_name} ({distance_km} km, in {days_until_event} d). "
+    "Rules: keep all facts, add none, 30-70 words, one paragraph, friendly tone. "
+    "Output only the new text.\n"
+    "Original: {current_description}"
+)
+
+BATCH_EVENT_TEMPLATE = (
+    "Event [{i}]: {event_name} ({event_type}, {event_date}) "
+    "at {venue_name} ({distance_km} km, in {days_until_event} d).\n"
+    "Original [{i}]: {current_description}"
+)
+
+# Client-side Gemini quota (requests per minute, shared by all tabs of this app)
+GEMINI_RPM = 10
+# Longest server-requested wait we sit through before giving up
+MAX_RETRY_WAIT_S = 30
+
+# Max events rewritten in one "Generate for all matches" call
+MAX_BATCH = 10
 
 st.set_page_config(page_title="EventBnb", layout="wide")
 
@@ -37,129 +102,419 @@ if "page" not in st.session_state:
     st.session_state["page"] = "results"  # results | generated
 if "last_lookup_id" not in st.session_state:
     st.session_state["last_lookup_id"] = ""
-if "last_matches" not in st.session_state:
-    st.session_state["last_matches"] = None
+if "last_matches_idx" not in st.session_state:
+    st.session_state["last_matches_idx"] = None  # int64 row positions in df (cheaper to keep than a DataFrame)
 if "generated_text" not in st.session_state:
     st.session_state["generated_text"] = None
+if "generated_batch" not in st.session_state:
+    st.session_state["generated_batch"] = None  # list of (event label, text)
+if "batch_skipped" not in st.session_state:
+    st.session_state["batch_skipped"] = 0  # matches left out of the last batch (over MAX_BATCH)
 if "selected_row" not in st.session_state:
     st.session_state["selected_row"] = None
 if "current_description" not in st.session_state:
     st.session_state["current_description"] = ""
 if "gen_in_flight" not in st.session_state:
     st.session_state["gen_in_flight"] = False
-if "last_gen_ts" not in st.session_state:
-    st.session_state["last_gen_ts"] = 0.0
 if "gen_count" not in st.session_state:
     st.session_state["gen_count"] = 0
 
 # ----------------------------
 # Data loading
 # ----------------------------
-@st.cache_data
-def load_df(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path)
-
-    # Ensure event_date is readable
-    if "event_date" in df.columns:
-        df["event_date"] = pd.to_datetime(df["event_date"], errors="coerce").dt.date
+@st.cache_resource(show_spinner=False)
+def load_df(path: str) -> tuple:
+    """
+    Returns (df, df_display): the full indexed frame, and the results table
+    (SHOW_COLS, renamed, event_date formatted) pre-sliced once so reruns only do an .iloc.
+    df_display is None when SHOW_COLS are missing from the CSV.
+    cache_resource hands every rerun the same objects (cache_data would unpickle a full
+    copy of both frames each time); nothing mutates them after this returns.
+    """
+    # On-disk Parquet copy of the CSV, survives restarts (the in-memory cache is per-process)
+    parquet_path = f"{path}.v{PARQUET_SCHEMA_VERSION}.parquet"
+    df = None
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        try:
+            # The file only holds the LOAD_COLS the CSV had, so read it whole
+            df = pd.read_parquet(parquet_path, engine="pyarrow")
+        except Exception:
+            df = None  # stale schema / pyarrow missing -> rebuild from CSV
+
+    if df is None:
+        # Only read the columns we use (missing ones are reported later in the UI)
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = [c for c in LOAD_COLS if c in header]
+        df = pd.read_csv(
+            path,
+            usecols=usecols,
+            dtype=CSV_DTYPES,
+            parse_dates=[c for c in ["event_date"] if c in usecols],
+        )
+
+        # Ensure event_date is a datetime64 column (parse_dates leaves text behind if any value is bad)
+        if "event_date" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["event_date"]):
+            df["event_date"] = pd.to_datetime(df["event_date"], errors="coerce")
+
+        # Write to a per-process temp file and swap it in, so another worker never
+        # sees (or writes over) a half-written cache
+        tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+        try:
+            df.to_parquet(tmp_path, engine="pyarrow", compression="zstd")
+            os.replace(tmp_path, parquet_path)
+        except Exception:
+            # cache is optional (pyarrow missing, read-only folder, ...)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    # Index on the key col -> hashed lookups instead of scanning the whole column per click
+    if KEY_COL in df.columns and df.index.name != KEY_COL:
+        # Stable sort keeps a listing's rows in CSV order (quicksort reorders them on python-backed strings)
+        df = df.set_index(KEY_COL, drop=False).sort_index(kind="stable")
+
+    df_display = None
+    if all(c in df.columns for c in SHOW_COLS):
+        df_display = df[SHOW_COLS].rename(columns=RENAME_COLS)
+        if pd.api.types.is_datetime64_any_dtype(df_display["event_date"]):
+            df_display["event_date"] = df_display["event_date"].dt.strftime(DATE_FMT)
+
+    return df, df_display
+
+
+def match_positions(df: pd.DataFrame, key: str) -> np.ndarray:
+    """Row positions of `key` in df as an int64 array (empty if not found)."""
+    if df.index.name == KEY_COL:
+        pos = df.index.get_indexer_for([key])
+        pos = pos[pos >= 0]
+    else:
+        pos = np.flatnonzero((df[KEY_COL] == key).to_numpy(dtype=bool, na_value=False))
+    return np.asarray(pos, dtype=np.int64)
 
-    # Normalize key col to string
-    if KEY_COL in df.columns:
-        df[KEY_COL] = df[KEY_COL].astype(str)
 
-    return df
+def matches_from_state(df: pd.DataFrame):
+    # Re-derive the last lookup's rows from the stored positions (None = no lookup yet)
+    idx = st.session_state.get("last_matches_idx")
+    return None if idx is None else df.iloc[idx]
 
 
 def is_valid_id(s: str) -> bool:
-    return bool(ID_RE.fullmatch((s or "").strip()))
+    # Same as fullmatch(r"[A-Za-z0-9]+"): for ASCII-only text isalnum() is exactly that set
+    s = (s or "").strip()
+    return s.isascii() and s.isalnum()
+
+
+def clip_description(current_description: str, max_chars: int = 400) -> str:
+    current_description = (current_description or "").strip()
+    if len(current_description) > max_chars:
+        current_description = current_description[:max_chars].rstrip() + "..."
+    return current_description
+
+
+def _prompt_value(col, v):
+    if v is None or pd.isna(v):
+        return PROMPT_DEFAULTS[col]
+    if isinstance(v, pd.Timestamp):
+        return v.strftime(DATE_FMT)
+    return v
 
 
-def build_prompt(event_row: pd.Series, current_description: str) -> str:
+def prompt_fields(row: tuple, col_pos: dict) -> dict:
+    # Plain tuple indexing (row from itertuples / tuple(view.iloc[i])), no Series lookups
+    return {c: _prompt_value(c, row[col_pos[c]] if c in col_pos else None) for c in PROMPT_FIELDS}
+
+
+def build_prompt(row: tuple, col_pos: dict, current_description: str) -> str:
     """
     Prompt tuned for Gemini:
     - enforce "no hallucinations"
     - short, punchy output
     - event-goer angle
+    Kept deliberately short: every input token adds to time-to-first-token.
     """
 
-    def g(col, default=""):
-        v = event_row.get(col, default)
-        if pd.isna(v):
-            return default
-        return v
-
-    event_name = g("event_name", "an upcoming event")
-    event_type = g("event_type", "event")
-    event_date = g("event_date", "")
-    venue_name = g("venue_name", "")
-    distance_km = g("distance_km", "")
-    days_until = g("days_until_event", "")
-    current_price = g("current_price", "")
-    suggested_price = g("suggested_price", "")
+    fields = prompt_fields(row, col_pos)
+    fields["current_description"] = clip_description(current_description)
+    return PROMPT_TEMPLATE.format_map(fields)
 
-    current_description = (current_description or "").strip()
-    if len(current_description) > 1500:
-        current_description = current_description[:1500].rstrip() + "..."
 
-    prompt = f"""
-Task: Rewrite an Airbnb listing description to attract guests attending an event.
+def make_prompt_builder(df: pd.DataFrame):
+    """
+    Specialize build_prompt for this CSV's shape. Prompt fields that have no
+    NaN anywhere in df are baked into the template as positional slots of the
+    row tuple, so only columns that can actually be missing get a default check.
+    Returns build_prompt_fast(row_tuple, current_description), or None when a
+    prompt field is not a column (callers then use build_prompt).
+    """
+    if any(c not in df.columns for c in PROMPT_FIELDS):
+        return None
+
+    pos = {c: i for i, c in enumerate(df.columns)}
+    populated = {c for c in PROMPT_FIELDS if df[c].notna().all()}
+    nullable = [c for c in PROMPT_FIELDS if c not in populated]
+
+    slots = {"current_description": "{current_description}"}
+    for c in PROMPT_FIELDS:
+        if c not in populated:
+            slots[c] = "{" + c + "}"
+        elif c == "event_date" and pd.api.types.is_datetime64_any_dtype(df[c]):
+            slots[c] = "{%d:%s}" % (pos[c], DATE_FMT)
+        else:
+            slots[c] = "{%d}" % pos[c]
+    fmt = PROMPT_TEMPLATE.format_map(slots).format
 
-Strict rules:
-- Keep ONLY facts stated in the original description. Do NOT invent amenities, rules, views, parking, neighborhood claims, or anything else.
-- 30–70 words, one paragraph.
-- Friendly, natural tone (no cringe marketing).
-- Mention the event and convenience to the venue using the provided event info.
+    def build_prompt_fast(row: tuple, current_description: str) -> str:
+        extra = {}
+        for c in nullable:
+            extra[c] = _prompt_value(c, row[pos[c]])
+        return fmt(*row, current_description=clip_description(current_description), **extra)
 
-Event info:
-- Name: {event_name}
-- Type: {event_type}
-- Date: {event_date}
-- Venue: {venue_name}
-- Distance to venue (km): {distance_km}
-- Days until event: {days_until}
+    return build_prompt_fast
 
-Pricing context (do not claim discounts or guarantees):
-- Current price: {current_price}
-- Suggested price: {suggested_price}
 
-Original description:
-{current_description}
+@st.cache_resource(show_spinner=False)
+def fast_prompt_builder(path: str):
+    # Built once per CSV (closures can't go through st.cache_data's pickling)
+    df, _ = load_df(path)
+    return make_prompt_builder(df)
 
-Output ONLY the improved description text:
-""".strip()
+
+def build_batch_prompt(rows: list, col_pos: dict, descs: list) -> str:
+    """
+    One prompt for several events: shared rules are sent once, each event is
+    tagged [i] and the model answers "[1] ... [2] ..." (see parse_batch_response).
+    """
+
+    blocks = []
+    for i, (row, desc) in enumerate(zip(rows, descs), start=1):
+        fields = prompt_fields(row, col_pos)
+        fields["current_description"] = clip_description(desc)
+        blocks.append(BATCH_EVENT_TEMPLATE.format_map(dict(fields, i=i)))
+
+    events = "\n".join(blocks)
+    footer = " ".join(f"[{i}] <text>" for i in range(1, len(blocks) + 1))
+
+    prompt = (
+        "Rewrite each Airbnb desc below for guests of its event. "
+        "Rules: keep all facts, add none, 30-70 words, one paragraph each, friendly tone.\n"
+        f"{events}\n"
+        f"Output ONLY: {footer}"
+    )
 
     return prompt
 
-def call_gemini_with_backoff(fn, max_retries=5):
+
+def parse_batch_response(text: str, k: int) -> list:
+    """Split "[1] ... [2] ..." back into k texts ("" for any the model skipped)."""
+    parts = BATCH_RE.split(text or "")
+    out = {}
+    # parts = [preamble, "1", text1, "2", text2, ...]
+    for num, body in zip(parts[1::2], parts[2::2]):
+        out.setdefault(int(num), body.strip())
+    return [out.get(i, "") for i in range(1, k + 1)]
+
+
+@st.cache_resource(show_spinner=False)
+def _gemini_call_log():
+    # Timestamps of recent Gemini calls. Module globals are re-created on every
+    # rerun, so the window lives in cache_resource to be shared across reruns/tabs.
+    return {"times": deque(), "lock": threading.Lock()}
+
+
+def wait_for_rate_slot(rpm: int = GEMINI_RPM, window_s: float = 60.0, on_wait=None) -> None:
+    """
+    Sliding-window limiter: block until fewer than `rpm` calls were made in the last `window_s`.
+    Sleeps without holding the lock and re-checks after waking (other sessions may take
+    the slot first). `on_wait(seconds)` is called before each sleep, e.g. to tell the user.
+    """
+    log = _gemini_call_log()
+    while True:
+        with log["lock"]:
+            times = log["times"]
+            now = time.time()
+            while times and now - times[0] >= window_s:
+                times.popleft()
+            if len(times) < rpm:
+                times.append(now)
+                return
+            wait_s = max(0.0, window_s - (now - times[0]))
+        if on_wait is not None:
+            on_wait(wait_s)
+        time.sleep(wait_s)
+
+
+class AIMD:
+    """
+    Additive-increase / multiplicative-decrease limit on concurrent Gemini calls.
+    Grows by `alpha` per success, shrinks by `beta` per 429. The limit never goes
+    below 1 call (below that the backoff in call_gemini_with_backoff does the waiting).
+    """
+
+    def __init__(self, lo=1.0, hi=8.0, alpha=0.5, beta=0.5):
+        self.c = lo
+        self.lo = lo
+        self.hi = hi
+        self.alpha = alpha
+        self.beta = beta
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self.c))
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.c = min(self.hi, self.c + self.alpha)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.c = max(self.lo, self.c * self.beta)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+
+@st.cache_resource(show_spinner=False)
+def _gemini_aimd() -> AIMD:
+    # Shared by all sessions, same reason as _gemini_call_log
+    return AIMD()
+
+
+def _parse_delay(v):
+    # "32s" / "1.5" / 32 -> seconds as float (None if unparseable)
+    try:
+        return float(str(v).strip().rstrip("s"))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(e):
+    """
+    Server-suggested wait for a rate-limit error, or None.
+    Looks at the Retry-After header and at google.rpc.RetryInfo in the error details.
+    """
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if headers is not None and hasattr(headers, "get"):
+        v = headers.get("retry-after") or headers.get("Retry-After")
+        if v is not None and _parse_delay(v) is not None:
+            return _parse_delay(v)
+
+    # google.api_core ResourceExhausted
+    retry_info = getattr(e, "retry_info", None)
+    delay = getattr(retry_info, "retry_delay", None)
+    if delay is not None:
+        return delay.seconds + delay.nanos / 1e9
+
+    # google-genai APIError: {"error": {"details": [{"@type": ".../google.rpc.RetryInfo", "retryDelay": "32s"}]}}
+    details = getattr(e, "details", None)
+    if isinstance(details, dict):
+        for d in details.get("error", {}).get("details", []) or []:
+            if isinstance(d, dict) and "retryDelay" in d:
+                return _parse_delay(d["retryDelay"])
+
+    return None
+
+
+class StreamCutOff(RuntimeError):
+    """
+    The Gemini stream broke after some text had arrived. That output is already
+    billed, so it is not retried; raising (rather than returning) keeps the cut-off
+    text out of _cached_generate. `partial` holds what was received.
+    """
+
+    def __init__(self, partial: str):
+        super().__init__("Gemini's response was cut off before it finished. Click Generate to try again.")
+        self.partial = partial
+
+
+def call_gemini_with_backoff(fn, max_retries=5, on_wait=None):
     for attempt in range(max_retries):
+        wait_for_rate_slot(on_wait=on_wait)
         try:
             return fn()
         except Exception as e:
             msg = str(e).lower()
             # common patterns: "429", "too many requests", "resource_exhausted"
             if "429" in msg or "too many requests" in msg or "resource_exhausted" in msg:
-                sleep_s = min((2 ** attempt) + random.random(), 10)
+                _gemini_aimd().on_throttle()
+                sleep_s = retry_after_seconds(e)
+                if sleep_s is None:
+                    sleep_s = min((2 ** attempt) + random.random(), 10)
+                elif sleep_s > MAX_RETRY_WAIT_S:
+                    raise RuntimeError(
+                        f"Gemini asked to wait {sleep_s:.0f}s before the next request. Try again after that."
+                    )
                 time.sleep(sleep_s)
                 continue
             raise
     raise RuntimeError("Gemini is rate-limiting right now. Try again in ~30–60 seconds.")
 
 
-def generate_description_gemini(api_key: str, model_name: str, prompt: str) -> str:
+@st.cache_resource(show_spinner=False)
+def _gemini_client(api_key: str):
     """
-    Gemini API call using google-genai SDK.
+    One genai.Client per API key, reused across reruns (keeps its connection pool warm).
     pip install -U google-genai
     """
     from google import genai
 
-    client = genai.Client(api_key=api_key)
+    return genai.Client(api_key=api_key)
+
 
-    response = client.models.generate_content(
-        model=model_name,
-        contents=prompt,
+def generate_description_gemini(api_key: str, model_name: str, prompt: str) -> str:
+    """
+    Gemini API call using google-genai SDK.
+    Streams the answer into a placeholder so the first words show up right away.
+    """
+    client = _gemini_client(api_key)
+    ph = st.empty()
+
+    def stream_once():
+        # Fresh buffer per attempt, so a retried stream overwrites the partial one
+        buf = []
+        try:
+            stream = client.models.generate_content_stream(
+                model=model_name,
+                contents=prompt,
+            )
+            for chunk in stream:
+                buf.append(chunk.text or "")
+                ph.write("".join(buf))
+        except Exception as e:
+            if not buf:
+                raise  # nothing generated yet -> normal retry / error path
+            raise StreamCutOff("".join(buf).strip()) from e
+        return "".join(buf)
+
+    # Only reached on a _cached_generate miss, so this counts real API calls
+    st.session_state["gen_count"] += 1
+    text = call_gemini_with_backoff(
+        stream_once,
+        on_wait=lambda s: ph.caption(f"Waiting {s:.0f}s for the app's Gemini quota ({GEMINI_RPM} calls/min)..."),
     )
+    _gemini_aimd().on_success()
+
+    return text.strip()
+
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def _cached_generate(model_name: str, prompt_sha: str, _api_key: str, _prompt: str) -> str:
+    # Keyed on (model, prompt hash) only; underscore args are not hashed by st.cache_data
+    return generate_description_gemini(api_key=_api_key, model_name=model_name, prompt=_prompt)
+
 
-    return (response.text or "").strip()
+def prompt_hash(prompt: str) -> str:
+    return hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
 
 
 # ----------------------------
@@ -167,7 +522,9 @@ def generate_description_gemini(api_key: str, model_name: str, prompt: str) -> s
 # ----------------------------
 st.title("EventBnb")
 
-df = load_df(CSV_PATH)
+df, df_display = load_df(CSV_PATH)
+# Column -> tuple position for rows kept as plain tuples (matches slice df, so same columns)
+col_pos = {c: i for i, c in enumerate(df.columns)}
 left, right = st.columns([1, 2], gap="large")
 
 with left:
@@ -201,6 +558,8 @@ with left:
     )
 
     generate_btn = st.button("Generate (based on selected event)")
+    generate_all_btn = st.button("Generate for all matches")
+    st.caption(f"Gemini calls this session: {st.session_state['gen_count']}")
 
     if st.session_state["page"] == "generated":
         st.divider()
@@ -215,15 +574,15 @@ with left:
 # ----------------------------
 if do_lookup:
     st.session_state["generated_text"] = None
+    st.session_state["generated_batch"] = None
     st.session_state["page"] = "results"
 
     if not is_valid_id(listing_id):
-        st.session_state["last_matches"] = None
+        st.session_state["last_matches_idx"] = None
         st.session_state["last_lookup_id"] = listing_id
     else:
         st.session_state["last_lookup_id"] = listing_id.strip()
-        matches = df[df[KEY_COL] == listing_id.strip()]
-        st.session_state["last_matches"] = matches.copy() if not matches.empty else pd.DataFrame()
+        st.session_state["last_matches_idx"] = match_positions(df, listing_id.strip())
 
 
 with right:
@@ -235,44 +594,68 @@ with right:
     if st.session_state["page"] == "generated":
         st.subheader("Generated description")
         txt = st.session_state.get("generated_text")
-        if not txt:
+        batch = st.session_state.get("generated_batch")
+        if batch:
+            skipped = st.session_state.get("batch_skipped", 0)
+            if skipped:
+                st.warning(
+                    f"Only the first {len(batch)} events were rewritten; {skipped} more were left out "
+                    f"(limit {MAX_BATCH} per call). Pick one on the results page to generate it."
+                )
+            for label, text in batch:
+                st.markdown(f"**{label}**")
+                st.write(text or "_(no text returned for this event)_")
+        elif not txt:
             st.warning("No generated text yet. Click Generate on the left.")
         else:
             st.write(txt)
 
     # Page: results
     else:
-        matches = st.session_state.get("last_matches", None)
+        # No copy: df is never mutated after load_df, and an empty slice is still .empty
+        matches = matches_from_state(df)
 
         if matches is None:
             st.info("Enter a listing_id and click **Find listing**. Examples: 27926486, 43546204, 45491410 ")
         elif matches.empty:
             st.warning("No events found for that listing_id.")
         else:
-            view = matches.copy()
+            view = matches
 
             missing = [c for c in SHOW_COLS if c not in view.columns]
-            if missing:
+            if missing or df_display is None:
                 st.error(f"Missing columns in CSV: {missing}")
             else:
-                table_df = view[SHOW_COLS].rename(columns=RENAME_COLS)
+                table_df = df_display.iloc[st.session_state["last_matches_idx"]]
 
                 st.subheader("Upcoming Events Near You")
                 st.dataframe(table_df, use_container_width=True)
 
                 st.subheader("Pick an event to target")
+                # Build every option label in one vectorized pass (no per-row Series in format_func)
+                def col_str(c):
+                    # table_df already has event_date formatted
+                    # Mask NaN/NA first: astype(str) turns them into "nan"/"<NA>" on pandas 2.x
+                    v = table_df[c]
+                    return v.astype(str).where(v.notna(), "")
+
+                labels = (
+                    pd.Series(range(len(view)), index=view.index).astype(str) + ": "
+                    + col_str("event_name") + " | "
+                    + col_str("event_date") + " | "
+                    + col_str("venue_name")
+                ).tolist()
                 row_idx = st.selectbox(
                     "Row index",
                     options=list(range(len(view))),
-                    format_func=lambda i: (
-                        f"{i}: {view.iloc[i].get('event_name','')} | "
-                        f"{view.iloc[i].get('event_date','')} | "
-                        f"{view.iloc[i].get('venue_name','')}"
-                    ),
+                    format_func=labels.__getitem__,
                 )
 
-                st.session_state["selected_row"] = view.iloc[row_idx]
-                st.session_state["current_description"] = str(view.iloc[row_idx].get("description", ""))
+                selected = tuple(view.iloc[row_idx])
+                st.session_state["selected_row"] = selected
+                st.session_state["current_description"] = (
+                    str(selected[col_pos["description"]]) if "description" in col_pos else ""
+                )
 
                 st.info("Now click **Generate (based on selected event)** on the left.")
 
@@ -280,11 +663,16 @@ with right:
 # ----------------------------
 # Generate action
 # ----------------------------
-if generate_btn:
-    if st.session_state.get("selected_row") is None:
+if generate_btn or generate_all_btn:
+    last_matches = matches_from_state(df)
+    if generate_btn and st.session_state.get("selected_row") is None:
         st.session_state["page"] = "results"
         st.toast("First run a lookup and select an event row.", icon="⚠️")
         st.rerun()
+    if generate_all_btn and (last_matches is None or last_matches.empty):
+        st.session_state["page"] = "results"
+        st.toast("First run a lookup that finds events.", icon="⚠️")
+        st.rerun()
 
     if not api_key or len(api_key.strip()) < 10:
         st.error("Please paste a valid Gemini API key to generate text.")
@@ -294,40 +682,63 @@ if generate_btn:
         st.warning("Generation already in progress. Please wait.")
         st.stop()
 
+    if generate_all_btn:
+        batch_rows = list(last_matches.head(MAX_BATCH).itertuples(index=False, name=None))
+        batch_descs = [str(r[col_pos["description"]]) if "description" in col_pos else "" for r in batch_rows]
+        prompt = build_batch_prompt(batch_rows, col_pos, batch_descs)
+    else:
+        selected_row = st.session_state["selected_row"]
+        current_desc = st.session_state.get("current_description", "")
+        build_fast = fast_prompt_builder(CSV_PATH)
+        if build_fast is not None:
+            prompt = build_fast(selected_row, current_desc)
+        else:
+            prompt = build_prompt(selected_row, col_pos, current_desc)
 
-    # COOLDOWN CHECK
-    now = time.time()
-    cooldown_seconds = 8
-    if now - st.session_state["last_gen_ts"] < cooldown_seconds:
-        wait = int(cooldown_seconds - (now - st.session_state["last_gen_ts"]))
-        st.warning(f"Please wait {wait}s before generating again.")
+    # CONCURRENCY CHECK (AIMD limit adapts to how often Gemini answers 429).
+    # Taken right before the try so the finally always gives the shared slot back.
+    aimd = _gemini_aimd()
+    if not aimd.try_acquire():
+        st.warning(f"Gemini is busy ({aimd.in_flight} request(s) in progress). Please try again in a moment.")
         st.stop()
 
-    st.session_state["gen_in_flight"] = True
-
-    selected_row = st.session_state["selected_row"]
-    current_desc = st.session_state.get("current_description", "")
-    prompt = build_prompt(selected_row, current_desc)
-
-    st.session_state["gen_count"] += 1
-    st.write(f"Gemini calls this session: {st.session_state['gen_count']}")
-
     # ACTUAL GEMINI CALL
+    st.session_state["gen_in_flight"] = True
     try:
         with st.spinner("Generating with Gemini..."):
-            new_desc = generate_description_gemini(
-                api_key=api_key.strip(),
-                model_name=model_name,
-                prompt=prompt,
+            new_desc = _cached_generate(
+                model_name,
+                prompt_hash(prompt),
+                api_key.strip(),
+                prompt,
             )
+    except StreamCutOff as e:
+        st.warning(str(e))
+        if e.partial:
+            st.caption("Partial text received:")
+            st.write(e.partial)
+        st.stop()
     except Exception as e:
-        st.session_state["gen_in_flight"] = False
         st.error(str(e))
         st.stop()
-
-    st.session_state["last_gen_ts"] = time.time()
-    st.session_state["gen_in_flight"] = False
-    st.session_state["generated_text"] = new_desc
+    finally:
+        # Also runs on Streamlit's rerun/stop exceptions (BaseException), e.g. a
+        # widget touched mid-stream, so neither flag nor slot can stay held
+        st.session_state["gen_in_flight"] = False
+        aimd.release()
+
+    if generate_all_btn:
+        texts = parse_batch_response(new_desc, len(batch_rows))
+        batch_fields = [prompt_fields(r, col_pos) for r in batch_rows]
+        st.session_state["batch_skipped"] = max(0, len(last_matches) - len(batch_rows))
+        st.session_state["generated_batch"] = [
+            (f"{f['event_name']} | {f['event_date']} | {f['venue_name']}", t)
+            for f, t in zip(batch_fields, texts)
+        ]
+        st.session_state["generated_text"] = None
+    else:
+        st.session_state["generated_batch"] = None
+        st.session_state["generated_text"] = new_desc
     st.session_state["page"] = "generated"
     st.rerun()
 